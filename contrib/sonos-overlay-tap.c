@@ -0,0 +1,72 @@
+/*
+ * sonos-overlay-tap: send one action to a running Sonos Control Overlay server.
+ *
+ * Writes the same 64-byte request frame as the Python CLI (action id followed
+ * by the NUL-padded speaker IP) to the server socket with a single sendto(),
+ * so a keypress does not start a Python interpreter. It cannot start the
+ * server itself; exits non-zero when no server is listening.
+ *
+ *   cc -O2 -o sonos-overlay-tap sonos-overlay-tap.c
+ *   sonos-overlay-tap <speaker_ip> <action>
+ *
+ * The socket path defaults to /tmp/sonos-ctl-overlay-<uid>.sock, like the
+ * server's default on macOS, and can be overridden with
+ * SONOS_CTL_OVERLAY_SOCKET.
+ */
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+#include <unistd.h>
+
+#define FRAME_SIZE 64
+
+/* Same order as ACTIONS in sonos_overlay/main.py; the index is the action id */
+static const char *actions[] = {"volume_up", "volume_down", "mute", "playpause", "next", "prev"};
+
+int main(int argc, char **argv) {
+    if (argc != 3) {
+        fprintf(stderr, "Usage: sonos-overlay-tap <speaker_ip> <action>\n");
+        return 2;
+    }
+
+    int action_id = -1;
+    for (size_t i = 0; i < sizeof(actions) / sizeof(*actions); i++) {
+        if (strcmp(argv[2], actions[i]) == 0) {
+            action_id = (int)i;
+            break;
+        }
+    }
+    size_t ip_len = strlen(argv[1]);
+    if (action_id < 0 || ip_len > FRAME_SIZE - 1) {
+        fprintf(stderr, "Invalid action or speaker IP\n");
+        return 2;
+    }
+
+    unsigned char frame[FRAME_SIZE] = {0};
+    frame[0] = (unsigned char)action_id;
+    memcpy(frame + 1, argv[1], ip_len);
+
+    struct sockaddr_un addr = {.sun_family = AF_UNIX};
+    const char *path = getenv("SONOS_CTL_OVERLAY_SOCKET");
+    int len;
+    if (path != NULL) {
+        len = snprintf(addr.sun_path, sizeof(addr.sun_path), "%s", path);
+    } else {
+        len = snprintf(addr.sun_path, sizeof(addr.sun_path), "/tmp/sonos-ctl-overlay-%u.sock",
+                       (unsigned)getuid());
+    }
+    if (len < 0 || (size_t)len >= sizeof(addr.sun_path)) {
+        fprintf(stderr, "Socket path too long\n");
+        return 2;
+    }
+
+    int fd = socket(AF_UNIX, SOCK_DGRAM, 0);
+    if (fd < 0 || sendto(fd, frame, sizeof(frame), 0, (struct sockaddr *)&addr, sizeof(addr)) < 0) {
+        return 1;
+    }
+    close(fd);
+    return 0;
+}
@@ -3,13 +3,19 @@ Configuration loader for Sonos Control Overlay.
 Loads settings from ~/.sonos-ctl-overlay.yml with sensible defaults.
 """
 
+import contextlib
+import functools
+import json
 import os
+import sys
 from dataclasses import dataclass, field
 from pathlib import Path
 
-import yaml
-
 CONFIG_PATH = Path.home() / ".sonos-ctl-overlay.yml"
+CACHE_PATH = Path.home() / ".cache" / "sonos-ctl-overlay.json"
+
+# Characters allowed in a hex color
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
 
 # Font Awesome Unicode characters
 FA_ICONS = {
@@ -24,7 +30,20 @@ FA_ICONS = {
 }
 
 
-@dataclass
+def default_socket_path() -> str:
+    """Return the default server socket address for this platform.
+
+    Linux uses the abstract namespace, which needs no file and is released
+    with the server; macOS has none, so the socket is a per-user file in /tmp.
+    Neither depends on the environment, so the CLI, the launch agent and the
+    native helper always agree on it.
+    """
+    if sys.platform == "linux":
+        return f"\0sonos-ctl-overlay-{os.getuid()}"
+    return f"/tmp/sonos-ctl-overlay-{os.getuid()}.sock"
+
+
+@dataclass(frozen=True, slots=True)
 class OverlayStyle:
     """Overlay appearance settings."""
 
@@ -33,9 +52,16 @@ class OverlayStyle:
     font_color: str = "#000000"
     corner_radius: int = 16
     duration_ms: int = 1500
+    background_rgb: tuple[float, float, float] = field(init=False, repr=False)
+    font_rgb: tuple[float, float, float] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        # Parse the hex colors once; frozen instances need object.__setattr__
+        object.__setattr__(self, "background_rgb", hex_to_rgb(self.background_color))
+        object.__setattr__(self, "font_rgb", hex_to_rgb(self.font_color))
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Config:
     """Application configuration."""
 
@@ -44,54 +70,118 @@ class Config:
     font_path: str = field(
         default_factory=lambda: str(Path.home() / "Library/Fonts/Font Awesome 7 Free-Solid-900.otf")
     )
-    socket_path: str = "/tmp/sonos-ctl-overlay.sock"
+    socket_path: str = field(default_factory=default_socket_path)
     style: OverlayStyle = field(default_factory=OverlayStyle)
 
 
 def hex_to_rgb(hex_color: str) -> tuple[float, float, float]:
-    """Convert hex color to RGB tuple (0-1 range)."""
+    """Convert a #RRGGBB or #RGB hex color to an RGB tuple (0-1 range).
+
+    Raises ValueError for anything else.
+    """
     hex_color = hex_color.lstrip("#")
+    if len(hex_color) == 3:
+        hex_color = "".join(c * 2 for c in hex_color)
+    if len(hex_color) != 6 or not set(hex_color) <= _HEX_DIGITS:
+        raise ValueError(f"Invalid hex color: #{hex_color}")
     r = int(hex_color[0:2], 16) / 255
     g = int(hex_color[2:4], 16) / 255
     b = int(hex_color[4:6], 16) / 255
     return (r, g, b)
 
 
-def load_config() -> Config:
-    """Load configuration from YAML file, falling back to defaults."""
-    config = Config()
+def _read_cache(src_stat: os.stat_result) -> dict | None:
+    """Return cached config data if it was built from the current YAML file."""
+    try:
+        with open(CACHE_PATH, "rb") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # Anything but the object _write_cache produces counts as a cache miss
+    if (
+        not isinstance(cache, dict)
+        or cache.get("_src_mtime") != src_stat.st_mtime_ns
+        or cache.get("_src_size") != src_stat.st_size
+    ):
+        return None
+    data = cache.get("data")
+    return data if isinstance(data, dict) else None
+
+
+def _write_cache(src_stat: os.stat_result, data: dict) -> None:
+    """Atomically write parsed config data to the JSON cache."""
+    tmp_path = CACHE_PATH.with_name(f"{CACHE_PATH.name}.{os.getpid()}.tmp")
+    cache = {"_src_mtime": src_stat.st_mtime_ns, "_src_size": src_stat.st_size, "data": data}
+    try:
+        CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp_path, "w") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, CACHE_PATH)
+    except (OSError, TypeError, ValueError):
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
 
-    if not CONFIG_PATH.exists():
-        return config
 
+@functools.lru_cache(maxsize=1)
+def load_config() -> Config:
+    """Load configuration from YAML file, falling back to defaults (memoized)."""
+    # Open once and fstat the descriptor instead of stat-ing the path first
     try:
-        with open(CONFIG_PATH) as f:
-            data = yaml.safe_load(f) or {}
-    except (yaml.YAMLError, OSError):
-        return config
-
-    # Top-level settings
+        fd = os.open(CONFIG_PATH, os.O_RDONLY)
+    except OSError:
+        return Config()
+
+    with os.fdopen(fd, "rb") as f:
+        # Reuse the JSON cache while the YAML file's mtime and size are unchanged
+        src_stat = os.fstat(fd)
+        data = _read_cache(src_stat)
+        if data is None:
+            import yaml
+
+            # Prefer the libyaml-backed loader; fall back to the pure-Python one
+            loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+            try:
+                data = yaml.load(f, Loader=loader) or {}
+            except (yaml.YAMLError, OSError):
+                return Config()
+            _write_cache(src_stat, data)
+
+    # Collect overrides first; both dataclasses are frozen and built once
+    kwargs = {}
     if "speaker_ip" in data:
-        config.speaker_ip = data["speaker_ip"]
+        kwargs["speaker_ip"] = data["speaker_ip"]
     if "volume_step" in data:
-        config.volume_step = int(data["volume_step"])
+        kwargs["volume_step"] = int(data["volume_step"])
     if "font_path" in data:
-        config.font_path = os.path.expanduser(data["font_path"])
+        kwargs["font_path"] = os.path.expanduser(data["font_path"])
     if "socket_path" in data:
-        config.socket_path = str(data["socket_path"])
+        kwargs["socket_path"] = str(data["socket_path"])
 
     # Style settings
+    style_kwargs = {}
     style_data = data.get("style", {})
     if style_data:
-        if "background_color" in style_data:
-            config.style.background_color = style_data["background_color"]
+        # An invalid color keeps its default rather than failing every call
+        for key in ("background_color", "font_color"):
+            if key in style_data:
+                try:
+                    hex_to_rgb(str(style_data[key]))
+                except ValueError:
+                    print(f"Invalid {key} in config, using default", file=sys.stderr)
+                else:
+                    style_kwargs[key] = str(style_data[key])
         if "background_opacity" in style_data:
-            config.style.background_opacity = float(style_data["background_opacity"])
-        if "font_color" in style_data:
-            config.style.font_color = style_data["font_color"]
+            style_kwargs["background_opacity"] = float(style_data["background_opacity"])
         if "corner_radius" in style_data:
-            config.style.corner_radius = int(style_data["corner_radius"])
+            style_kwargs["corner_radius"] = int(style_data["corner_radius"])
         if "duration_ms" in style_data:
-            config.style.duration_ms = int(style_data["duration_ms"])
+            style_kwargs["duration_ms"] = int(style_data["duration_ms"])
+
+    return Config(**kwargs, style=OverlayStyle(**style_kwargs))
+
 
-    return config
+def reload_config() -> Config:
+    """Drop the memoized config and load it again from disk."""
+    load_config.cache_clear()
+    return load_config()
@@ -0,0 +1,131 @@
+"""
+launchd integration for Sonos Control Overlay.
+Installs a per-user launch agent that owns the overlay socket and starts the
+server on the first datagram (socket activation), so the server stays resident
+and CLI invocations only ever send to the socket.
+"""
+
+import contextlib
+import ctypes
+import fcntl
+import os
+import plistlib
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .config import Config
+from .main import open_pid_file
+
+AGENT_LABEL = "com.github.mietzen.sonos-ctl-overlay"
+AGENT_PATH = Path.home() / "Library" / "LaunchAgents" / f"{AGENT_LABEL}.plist"
+
+# Key of the socket entry in the agent's Sockets dictionary
+SOCKET_NAME = "Listeners"
+
+# Seconds to wait for a server started without launchd to exit
+STOP_TIMEOUT = 5.0
+
+
+def activate_socket(name: str = SOCKET_NAME) -> list[int]:
+    """Return the file descriptors launchd created for the named socket.
+
+    Returns an empty list when the process was not started by launchd.
+    """
+    if sys.platform != "darwin":
+        return []
+
+    libc = ctypes.CDLL(None)
+    fds = ctypes.POINTER(ctypes.c_int)()
+    count = ctypes.c_size_t()
+    if libc.launch_activate_socket(name.encode(), ctypes.byref(fds), ctypes.byref(count)):
+        return []
+
+    result = [fds[i] for i in range(count.value)]
+    libc.free(fds)
+    return result
+
+
+def _launchctl(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(["launchctl", *args], capture_output=True, text=True)
+
+
+def _stop_fallback_server(pid_path: str) -> bool:
+    """Stop a server started without launchd and wait until it has exited.
+
+    Such a server holds an flock on its PID file until it exits, so a held
+    lock proves the PID in the file is ours and its release means the server
+    has finished cleaning up. Returns False if the PID file cannot be trusted
+    or the server did not exit in time.
+    """
+    try:
+        fd = open_pid_file(pid_path)
+    except FileNotFoundError:
+        return True
+    except OSError as e:
+        print(f"Error opening PID file: {e}", file=sys.stderr)
+        return False
+
+    try:
+        # An unlocked PID file is stale and may name an unrelated process
+        with contextlib.suppress(BlockingIOError):
+            fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            return True
+
+        with contextlib.suppress(OSError, ValueError):
+            os.kill(int(os.pread(fd, 32, 0)), signal.SIGTERM)
+
+        deadline = time.monotonic() + STOP_TIMEOUT
+        while time.monotonic() < deadline:
+            with contextlib.suppress(BlockingIOError):
+                fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                return True
+            time.sleep(0.05)
+        return False
+    finally:
+        os.close(fd)
+
+
+def install_agent(config: Config, pid_path: str) -> None:
+    """Write the launch agent plist and load it into the user's GUI session."""
+    plist = {
+        "Label": AGENT_LABEL,
+        "ProgramArguments": [sys.executable, "-m", "sonos_overlay", "--server"],
+        "Sockets": {
+            SOCKET_NAME: {
+                "SockPathName": config.socket_path,
+                "SockType": "dgram",
+                "SockFamily": "Unix",
+            }
+        },
+        "ProcessType": "Interactive",
+    }
+    AGENT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(AGENT_PATH, "wb") as f:
+        plistlib.dump(plist, f)
+
+    # Stop a server started without launchd; launchd must own the socket path
+    if not _stop_fallback_server(pid_path):
+        print("Error: running overlay server did not exit", file=sys.stderr)
+        sys.exit(1)
+    for path in (config.socket_path, pid_path):
+        with contextlib.suppress(OSError):
+            os.unlink(path)
+
+    domain = f"gui/{os.getuid()}"
+    _launchctl("bootout", domain, str(AGENT_PATH))
+    result = _launchctl("bootstrap", domain, str(AGENT_PATH))
+    if result.returncode != 0:
+        print(f"Error loading launch agent: {result.stderr.strip()}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Installed launch agent {AGENT_PATH}")
+
+
+def uninstall_agent() -> None:
+    """Unload the launch agent and remove its plist."""
+    _launchctl("bootout", f"gui/{os.getuid()}", str(AGENT_PATH))
+    with contextlib.suppress(OSError):
+        AGENT_PATH.unlink()
+    print(f"Removed launch agent {AGENT_PATH}")
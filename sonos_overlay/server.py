@@ -0,0 +1,535 @@
+"""
+Overlay server for Sonos Control Overlay.
+Owns the speaker connection (see speaker.py) and draws the overlay using
+native macOS APIs.
+Only imported once main() has decided to run as the server.
+"""
+
+from __future__ import annotations
+
+import atexit
+import contextlib
+import errno
+import fcntl
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+from collections.abc import Callable
+
+import dispatch
+from AppKit import (
+    NSApplication,
+    NSApplicationActivationPolicyProhibited,
+    NSApplicationDidChangeScreenParametersNotification,
+    NSBackingStoreBuffered,
+    NSColor,
+    NSFont,
+    NSFontAttributeName,
+    NSForegroundColorAttributeName,
+    NSMakeRect,
+    NSMutableParagraphStyle,
+    NSParagraphStyleAttributeName,
+    NSScreen,
+    NSTextField,
+    NSTimer,
+    NSView,
+    NSWindow,
+    NSWindowStyleMaskBorderless,
+)
+from CoreText import CTFontManagerRegisterFontsForURL, kCTFontManagerScopeProcess
+from Foundation import (
+    NSURL,
+    NSAttributedString,
+    NSDate,
+    NSNotificationCenter,
+    NSOperationQueue,
+)
+from PyObjCTools import AppHelper
+
+from .config import FA_ICONS, Config, reload_config
+from .launchd import activate_socket
+from .main import REQUEST_FRAME, decode_request, get_pid_path, open_pid_file, send_to_server
+from .speaker import (
+    SPEAKER_STATE_TTL,
+    SpeakerCommand,
+    get_speaker,
+    get_speaker_state,
+    predict_state,
+    run_speaker_worker,
+    run_transport_listener,
+)
+
+# Window dimensions
+SQUARE_SIZE = 120
+VOLUME_WIDTH = 300
+VOLUME_HEIGHT = 100
+WINDOW_Y_OFFSET = 150
+
+# Repeat interval for reusable timers; they are always re-armed explicitly
+TIMER_PARK_INTERVAL = 1e9
+
+# Icons bound to module names so hot paths skip the FA_ICONS lookup
+_VOL_HIGH, _VOL_LOW, _VOL_OFF, _VOL_XMARK, _PLAY, _PAUSE, _FWD, _BACK = (
+    FA_ICONS[name]
+    for name in (
+        "volume_high",
+        "volume_low",
+        "volume_off",
+        "volume_xmark",
+        "play",
+        "pause",
+        "forward_step",
+        "backward_step",
+    )
+)
+
+# Volume icon per mute flag and volume level (0-100)
+_VOLUME_ICONS = ([_VOL_OFF] + [_VOL_LOW] * 32 + [_VOL_HIGH] * 68, [_VOL_XMARK] * 101)
+
+# Playback icon per transport state; any other state shows pause
+_PLAYBACK_ICONS = {"PLAYING": _PLAY}
+
+# Volume bar foreground frame per volume level (0-100)
+_BAR_FRAMES = [NSMakeRect(25, 20, 2.5 * volume, 8) for volume in range(101)]
+
+# Font names to try after registering the Font Awesome file
+FA_FONT_NAMES = ["Font Awesome 6 Free Solid", "FontAwesome6Free-Solid", "Font Awesome 6 Free"]
+
+
+def get_playback_icon(state: str) -> str:
+    """Return appropriate Font Awesome icon for playback state."""
+    return _PLAYBACK_ICONS.get(state, _PAUSE)
+
+
+def _socket_in_use(socket_path: str) -> bool:
+    """Check whether a live process is bound to the socket path."""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        probe.connect(socket_path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    except OSError:
+        return True
+    finally:
+        probe.close()
+    return True
+
+
+def claim_server_socket(socket_path: str) -> tuple[socket.socket, int] | None:
+    """Bind the server socket unless another server already owns it.
+
+    Servers started without launchd hold an flock on the PID file for their
+    whole life, so only one of them can own the socket path. The lock holder
+    still binds without unlinking first: a path that accepts connections
+    belongs to a live server or to launchd, and only one that refuses them is
+    left over from a dead server. Returns the bound socket and the locked PID
+    file descriptor, or None when the socket is taken.
+    """
+    try:
+        pid_fd = open_pid_file(get_pid_path(socket_path), os.O_RDWR | os.O_CREAT)
+    except OSError as e:
+        print(f"Error opening PID file: {e}", file=sys.stderr)
+        return None
+    try:
+        fcntl.flock(pid_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(pid_fd)
+        return None
+
+    # The PID is written before binding so a locked file always names the
+    # lock holder; it is cleared again if the socket turns out to be taken
+    os.ftruncate(pid_fd, 0)
+    os.write(pid_fd, str(os.getpid()).encode())
+
+    server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        server_socket.bind(socket_path)
+    except OSError as e:
+        if e.errno != errno.EADDRINUSE or _socket_in_use(socket_path):
+            server_socket.close()
+            os.ftruncate(pid_fd, 0)
+            os.close(pid_fd)
+            return None
+        os.unlink(socket_path)
+        server_socket.bind(socket_path)
+    return server_socket, pid_fd
+
+
+def get_window_frames() -> dict:
+    """Return the window frame per layout (keyed by is_square) on the main screen."""
+    screen_width = NSScreen.mainScreen().frame().size.width
+    return {
+        True: NSMakeRect(
+            (screen_width - SQUARE_SIZE) / 2, WINDOW_Y_OFFSET, SQUARE_SIZE, SQUARE_SIZE
+        ),
+        False: NSMakeRect(
+            (screen_width - VOLUME_WIDTH) / 2, WINDOW_Y_OFFSET, VOLUME_WIDTH, VOLUME_HEIGHT
+        ),
+    }
+
+
+def create_signal_source(signum: int, handler: Callable[[], None]) -> object:
+    """Call `handler` on the main queue whenever the process receives `signum`.
+
+    The signal itself is ignored so its default action cannot end the process
+    first. The returned dispatch source must be kept alive.
+    """
+    signal.signal(signum, signal.SIG_IGN)
+    source = dispatch.dispatch_source_create(
+        dispatch.DISPATCH_SOURCE_TYPE_SIGNAL, signum, 0, dispatch.dispatch_get_main_queue()
+    )
+    dispatch.dispatch_source_set_event_handler(source, handler)
+    dispatch.dispatch_resume(source)
+    return source
+
+
+def resolve_fa_font_name(font_path: str) -> str | None:
+    """Register the Font Awesome file and return its font name (None if unusable)."""
+    if not os.path.isfile(font_path):
+        return None
+
+    font_url = NSURL.fileURLWithPath_(font_path)
+    CTFontManagerRegisterFontsForURL(font_url, kCTFontManagerScopeProcess, None)
+    for font_name in FA_FONT_NAMES:
+        if NSFont.fontWithName_size_(font_name, 48):
+            return font_name
+    return None
+
+
+def run_overlay_server(config: Config, request: dict | None = None) -> None:
+    """Run overlay using native macOS APIs - no focus stealing.
+
+    The server owns the speaker connection: clients only send the requested
+    action and the server executes it before updating the display. It stays
+    resident; when started by the launch agent it adopts the socket launchd
+    created, otherwise it binds the socket itself and executes `request`. If
+    another server already owns the socket, `request` is handed to it instead.
+    """
+    style = config.style
+    font_path = config.font_path
+    socket_path = config.socket_path
+
+    # Setup socket server: adopt the launchd socket if we were activated by
+    # the launch agent, otherwise bind our own
+    launchd_fds = activate_socket()
+    if launchd_fds:
+        server_socket = socket.socket(fileno=launchd_fds[0])
+        owned_files = []
+    else:
+        claimed = claim_server_socket(socket_path)
+        if claimed is None:
+            # Another server owns the socket; hand it our request and exit
+            if request:
+                send_to_server(request, socket_path)
+            return
+        # The PID file descriptor stays open, and locked, until the process exits
+        server_socket, _pid_fd = claimed
+
+        # Files this server created, with their inodes so cleanup never
+        # removes one that another process has put in its place
+        owned_paths = [get_pid_path(socket_path)]
+        if not socket_path.startswith("\0"):
+            owned_paths.append(socket_path)
+        owned_files = [(path, os.stat(path).st_ino) for path in owned_paths]
+    server_socket.setblocking(False)
+
+    # Parse style settings
+    bg_r, bg_g, bg_b = style.background_rgb
+    bg_opacity = style.background_opacity
+    fg_r, fg_g, fg_b = style.font_rgb
+    corner_radius = style.corner_radius
+
+    # All colors are built once; font_color is reused for the bar foreground
+    make_color = NSColor.colorWithCalibratedRed_green_blue_alpha_
+    background_color = make_color(bg_r, bg_g, bg_b, bg_opacity)
+    font_color = make_color(fg_r, fg_g, fg_b, 1.0)
+    bar_track_color = make_color(fg_r, fg_g, fg_b, 0.25)
+
+    # Settings read on every update; refreshed from disk on SIGHUP
+    settings = {"volume_step": config.volume_step, "duration_ms": style.duration_ms}
+
+    # Prevent app from appearing in dock or stealing focus
+    app = NSApplication.sharedApplication()
+    app.setActivationPolicy_(NSApplicationActivationPolicyProhibited)
+
+    # Load Font Awesome
+    fa_font = None
+    fa_font_name = resolve_fa_font_name(font_path)
+    if fa_font_name:
+        fa_font = NSFont.fontWithName_size_(fa_font_name, 48)
+
+    if not fa_font:
+        fa_font = NSFont.boldSystemFontOfSize_(48)
+
+    fa_font_small = NSFont.fontWithName_size_(fa_font.fontName(), 36)
+    if not fa_font_small:
+        fa_font_small = NSFont.boldSystemFontOfSize_(36)
+
+    # Every icon is styled once; updates swap in a ready attributed string
+    # instead of setting a plain string that the label has to style again
+    paragraph_style = NSMutableParagraphStyle.alloc().init()
+    paragraph_style.setAlignment_(1)
+
+    def make_title(icon: str, font: NSFont) -> NSAttributedString:
+        return NSAttributedString.alloc().initWithString_attributes_(
+            icon,
+            {
+                NSFontAttributeName: font,
+                NSForegroundColorAttributeName: font_color,
+                NSParagraphStyleAttributeName: paragraph_style,
+            },
+        )
+
+    titles = {
+        icon: make_title(icon, fa_font_small)
+        for icon in (_VOL_HIGH, _VOL_LOW, _VOL_OFF, _VOL_XMARK)
+    }
+    titles.update({icon: make_title(icon, fa_font) for icon in (_PLAY, _PAUSE, _FWD, _BACK)})
+    volume_titles = [[titles[icon] for icon in icons] for icons in _VOLUME_ICONS]
+
+    # Determine window size based on action type
+    action = request["action"] if request else ""
+    is_square = action in ["playpause", "next", "prev"]
+
+    # Window and icon frames per layout (keyed by is_square); the window
+    # frames are recomputed when the screen configuration changes
+    window_frames = get_window_frames()
+    icon_frames = {
+        True: NSMakeRect(0, 36, SQUARE_SIZE, 48),
+        False: NSMakeRect(0, 45, VOLUME_WIDTH, 45),
+    }
+
+    window = NSWindow.alloc().initWithContentRect_styleMask_backing_defer_(
+        window_frames[is_square],
+        NSWindowStyleMaskBorderless,
+        NSBackingStoreBuffered,
+        False,
+    )
+    window.setLevel_(2000)
+    window.setOpaque_(False)
+    window.setBackgroundColor_(NSColor.clearColor())
+    window.setIgnoresMouseEvents_(True)
+    window.setHasShadow_(False)
+
+    # Create content view with rounded corners and background color
+    content_view = window.contentView()
+    content_view.setWantsLayer_(True)
+    content_view.layer().setBackgroundColor_(background_color.CGColor())
+    content_view.layer().setCornerRadius_(corner_radius)
+    content_view.layer().setMasksToBounds_(True)
+
+    # Icon label
+    icon_label = NSTextField.alloc().initWithFrame_(icon_frames[is_square])
+    icon_label.setBezeled_(False)
+    icon_label.setDrawsBackground_(False)
+    icon_label.setEditable_(False)
+    icon_label.setSelectable_(False)
+    icon_label.setTextColor_(font_color)
+    icon_label.setFont_(fa_font)
+    icon_label.setAlignment_(1)
+    content_view.addSubview_(icon_label)
+
+    # Progress bar background (for volume)
+    bar_bg = NSView.alloc().initWithFrame_(NSMakeRect(25, 20, 250, 8))
+    bar_bg.setWantsLayer_(True)
+    bar_bg.layer().setBackgroundColor_(bar_track_color.CGColor())
+    bar_bg.layer().setCornerRadius_(4)
+    bar_bg.setHidden_(is_square)
+    content_view.addSubview_(bar_bg)
+
+    # Progress bar foreground
+    bar_fg = NSView.alloc().initWithFrame_(NSMakeRect(25, 20, 0, 8))
+    bar_fg.setWantsLayer_(True)
+    bar_fg.layer().setBackgroundColor_(font_color.CGColor())
+    bar_fg.layer().setCornerRadius_(4)
+    bar_fg.setHidden_(is_square)
+    content_view.addSubview_(bar_fg)
+
+    # State to track
+    overlay_state = {"is_square": None, "last_state": None}
+
+    def on_screen_change(_notification: object) -> None:
+        window_frames.update(get_window_frames())
+        if overlay_state["is_square"] is not None:
+            window.setFrame_display_(window_frames[overlay_state["is_square"]], True)
+
+    NSNotificationCenter.defaultCenter().addObserverForName_object_queue_usingBlock_(
+        NSApplicationDidChangeScreenParametersNotification,
+        None,
+        NSOperationQueue.mainQueue(),
+        on_screen_change,
+    )
+
+    # Timers are created once, parked in the distant future and re-armed
+    # with setFireDate_ instead of being rescheduled on every update
+    def hide_window(timer: object) -> None:
+        window.orderOut_(None)
+        timer.setFireDate_(NSDate.distantFuture())
+
+    hide_timer = NSTimer.scheduledTimerWithTimeInterval_repeats_block_(
+        TIMER_PARK_INTERVAL, True, hide_window
+    )
+    hide_timer.setFireDate_(NSDate.distantFuture())
+
+    def draw_state(state: dict) -> None:
+        action = state.get("action", "")
+        is_square_action = action in ["playpause", "next", "prev"]
+
+        # Only resize and restyle when switching between volume and playback
+        # layouts; repeated updates of the same kind just change the content
+        if is_square_action != overlay_state["is_square"]:
+            overlay_state["is_square"] = is_square_action
+            window.setFrame_display_(window_frames[is_square_action], True)
+            icon_label.setFrame_(icon_frames[is_square_action])
+            bar_bg.setHidden_(is_square_action)
+            bar_fg.setHidden_(is_square_action)
+
+        if action in ["volume_up", "volume_down", "mute"]:
+            volume = state.get("volume", 0)
+            is_muted = state.get("muted", False)
+            icon_label.setAttributedStringValue_(volume_titles[is_muted][volume])
+            bar_fg.setFrame_(_BAR_FRAMES[volume])
+        elif action == "playpause":
+            playback_state = state.get("state", "PAUSED_PLAYBACK")
+            icon_label.setAttributedStringValue_(titles[get_playback_icon(playback_state)])
+        elif action in ["next", "prev"]:
+            icon_label.setAttributedStringValue_(titles[_FWD if action == "next" else _BACK])
+
+    def update_display(state: dict) -> None:
+        # An unchanged state (e.g. volume_up at 100) only keeps the overlay up
+        if state != overlay_state["last_state"]:
+            overlay_state["last_state"] = state
+            draw_state(state)
+
+        # Show window and re-arm the hide timer
+        window.orderFrontRegardless()
+        hide_timer.setFireDate_(
+            NSDate.dateWithTimeIntervalSinceNow_(settings["duration_ms"] / 1000.0)
+        )
+
+    # Speaker calls run on a worker thread so the overlay never waits for
+    # the network; results and corrections come back on the main thread
+    def on_speaker_state(ip: str, state: dict | None) -> None:
+        cache = get_speaker_state(ip)
+        if state is None:
+            cache.update(ts=-SPEAKER_STATE_TTL, transport_state=None)
+            return
+        if "volume" in state:
+            cache.update(volume=state["volume"], muted=state["muted"], ts=time.monotonic())
+        elif state["action"] == "playpause" and cache["transport_state"] is not None:
+            # Correct a failed prediction; without events the cache stays unset
+            cache["transport_state"] = state["state"]
+        update_display(state)
+
+    speaker_commands: queue.Queue = queue.Queue()
+    threading.Thread(
+        target=run_speaker_worker,
+        args=(speaker_commands, lambda ip, state: AppHelper.callAfter(on_speaker_state, ip, state)),
+        daemon=True,
+    ).start()
+
+    def on_transport_state(ip: str, transport_state: str | None) -> None:
+        get_speaker_state(ip)["transport_state"] = transport_state
+
+    # Speakers are subscribed to transport events on first use
+    transport_inbox: queue.Queue = queue.Queue()
+    watched_ips: set[str] = set()
+    threading.Thread(
+        target=run_transport_listener,
+        args=(
+            transport_inbox,
+            lambda ip, state: AppHelper.callAfter(on_transport_state, ip, state),
+        ),
+        daemon=True,
+    ).start()
+
+    def handle_request(request: dict) -> dict | None:
+        """Queue the speaker call for a request; return the state to show now."""
+        ip = request["speaker_ip"]
+        speaker = get_speaker(ip)
+        if not speaker:
+            return None
+        if ip not in watched_ips:
+            watched_ips.add(ip)
+            transport_inbox.put(speaker)
+
+        # The predicted state can be shown right away when the cache allows it
+        action = request["action"]
+        volume_step = settings["volume_step"]
+        predicted = predict_state(action, volume_step, get_speaker_state(ip))
+        speaker_commands.put(SpeakerCommand(ip, speaker, action, volume_step, predicted))
+        return predicted
+
+    # A GCD read source on the main queue stays armed between messages.
+    # Requests are fixed-size frames, so each recv() allocates just one frame
+    frame_size = REQUEST_FRAME.size
+
+    def handle_socket_data() -> None:
+        # Drain everything queued so a held key is handled in one wake-up;
+        # every request reaches the speaker but only the last state is drawn
+        last_state = None
+        while True:
+            try:
+                data = server_socket.recv(frame_size)
+            except OSError:
+                break
+            with contextlib.suppress(Exception):
+                last_state = handle_request(decode_request(data)) or last_state
+        if last_state:
+            update_display(last_state)
+
+    read_source = dispatch.dispatch_source_create(
+        dispatch.DISPATCH_SOURCE_TYPE_READ,
+        server_socket.fileno(),
+        0,
+        dispatch.dispatch_get_main_queue(),
+    )
+    dispatch.dispatch_source_set_event_handler(read_source, handle_socket_data)
+    dispatch.dispatch_resume(read_source)
+
+    # Execute and show the request that started the server
+    if request:
+        state = handle_request(request)
+        if state:
+            update_display(state)
+
+    # Cleanup on exit; the launchd socket path belongs to launchd. The PID
+    # file lock is released when the process exits
+    def cleanup() -> None:
+        server_socket.close()
+        for path, inode in owned_files:
+            with contextlib.suppress(OSError):
+                if os.stat(path).st_ino == inode:
+                    os.unlink(path)
+
+    atexit.register(cleanup)
+
+    # Signals are delivered by dispatch sources on the main queue, so their
+    # handlers run as soon as the run loop is free rather than whenever the
+    # Python signal handler gets a turn
+    def handle_sigterm() -> None:
+        cleanup()
+        os._exit(0)
+
+    def handle_sighup() -> None:
+        # A config that fails to load keeps the current settings
+        try:
+            config = reload_config()
+        except Exception as e:
+            print(f"Error reloading config: {e}", file=sys.stderr)
+            return
+        settings["volume_step"] = config.volume_step
+        settings["duration_ms"] = config.style.duration_ms
+
+    # Referenced here so the sources live as long as the run loop below
+    _signal_sources = [
+        create_signal_source(signal.SIGTERM, handle_sigterm),
+        create_signal_source(signal.SIGHUP, handle_sighup),
+    ]
+
+    # Run the app
+    app.run()
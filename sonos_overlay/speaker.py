@@ -0,0 +1,250 @@
+"""
+Speaker control for Sonos Control Overlay.
+Executes actions against SoCo speakers and predicts their outcome from cached
+state. Used by the overlay server; has no AppKit dependency.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import queue
+import sys
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+
+import soco
+
+# Speakers by IP, reused across requests by the resident server
+_SPEAKERS: dict[str, soco.SoCo] = {}
+
+# Last known volume/mute per speaker IP and when they were read from the speaker,
+# plus the transport state pushed by AVTransport events (None until the first)
+_SPEAKER_STATE: dict[str, dict] = {}
+
+# Seconds a cached volume/mute state is trusted before reading it again
+SPEAKER_STATE_TTL = 30.0
+
+
+class SpeakerCommand(NamedTuple):
+    """A speaker call queued for run_speaker_worker."""
+
+    ip: str
+    speaker: soco.SoCo
+    action: str
+    volume_step: int
+    predicted: dict | None
+
+
+def get_speaker(ip: str) -> soco.SoCo | None:
+    """Get speaker by IP address directly, reusing one instance per IP."""
+    speaker = _SPEAKERS.get(ip)
+    if speaker is None:
+        try:
+            speaker = _SPEAKERS[ip] = soco.SoCo(ip)
+        except Exception as e:
+            print(f"Error connecting to speaker at {ip}: {e}", file=sys.stderr)
+    return speaker
+
+
+def get_speaker_state(ip: str) -> dict:
+    """Return the cached volume/mute state for a speaker IP."""
+    return _SPEAKER_STATE.setdefault(
+        ip, {"volume": 0, "muted": False, "ts": -SPEAKER_STATE_TTL, "transport_state": None}
+    )
+
+
+def execute_action(speaker: soco.SoCo, action: str, volume_step: int) -> dict:
+    """Execute the Sonos command and return current state info."""
+    result = {"action": action}
+    try:
+        if action in ("volume_up", "volume_down"):
+            # SetRelativeVolume clamps on the speaker and returns the new
+            # volume, replacing a GetVolume + SetVolume pair
+            result["volume"] = speaker.set_relative_volume(_volume_delta(action, volume_step))
+            result["muted"] = speaker.mute
+
+        elif action == "mute":
+            current_mute = speaker.mute
+            speaker.mute = not current_mute
+            result["volume"] = speaker.volume
+            result["muted"] = not current_mute
+
+        elif action == "playpause":
+            state = speaker.get_current_transport_info()["current_transport_state"]
+            if state == "PLAYING":
+                speaker.pause()
+                result["state"] = "PAUSED_PLAYBACK"
+            else:
+                speaker.play()
+                result["state"] = "PLAYING"
+
+        elif action == "next":
+            speaker.next()
+            result["state"] = "PLAYING"
+
+        elif action == "prev":
+            speaker.previous()
+            result["state"] = "PLAYING"
+
+    except Exception as e:
+        print(f"Error executing action: {e}", file=sys.stderr)
+
+    return result
+
+
+def _volume_delta(action: str, volume_step: int) -> int:
+    """Return the signed volume change of a volume_up or volume_down action."""
+    return volume_step if action == "volume_up" else -volume_step
+
+
+def predict_state(action: str, volume_step: int, cache: dict) -> dict | None:
+    """Compute the state an action will produce without talking to the speaker.
+
+    Updates `cache` (see get_speaker_state) optimistically. Returns None when
+    the outcome depends on a read from the speaker: a stale volume cache, or
+    play/pause before the first transport event.
+    """
+    if action in ("next", "prev"):
+        return {"action": action, "state": "PLAYING"}
+    if action == "playpause":
+        if cache["transport_state"] is None:
+            return None
+        playing = cache["transport_state"] == "PLAYING"
+        cache["transport_state"] = "PAUSED_PLAYBACK" if playing else "PLAYING"
+        return {"action": action, "state": cache["transport_state"]}
+    if time.monotonic() - cache["ts"] >= SPEAKER_STATE_TTL:
+        return None
+
+    if action in ("volume_up", "volume_down"):
+        cache["volume"] = min(100, max(0, cache["volume"] + _volume_delta(action, volume_step)))
+    elif action == "mute":
+        cache["muted"] = not cache["muted"]
+    else:
+        return None
+    return {"action": action, "volume": cache["volume"], "muted": cache["muted"]}
+
+
+def apply_state(speaker: soco.SoCo, state: dict) -> None:
+    """Send a state from predict_state to the speaker with a single call.
+
+    Volume steps are not absolute states; run_speaker_worker sends them as
+    relative changes.
+    """
+    action = state["action"]
+    if action == "mute":
+        speaker.mute = state["muted"]
+    elif action == "playpause":
+        if state["state"] == "PLAYING":
+            speaker.play()
+        else:
+            speaker.pause()
+    elif action == "next":
+        speaker.next()
+    elif action == "prev":
+        speaker.previous()
+
+
+def read_state(speaker: soco.SoCo, action: str) -> dict | None:
+    """Read the actual speaker state to correct a failed prediction.
+
+    Returns None for next/prev, whose overlay does not depend on the speaker.
+    """
+    try:
+        if action == "playpause":
+            info = speaker.get_current_transport_info()
+            return {"action": action, "state": info["current_transport_state"]}
+        if action in ("volume_up", "volume_down", "mute"):
+            return {"action": action, "volume": speaker.volume, "muted": speaker.mute}
+    except Exception:
+        pass
+    return None
+
+
+def _is_volume_step(command: SpeakerCommand | None) -> bool:
+    """Check whether a command is a predicted volume step."""
+    return (
+        command is not None
+        and command.predicted is not None
+        and command.action in ("volume_up", "volume_down")
+    )
+
+
+def run_speaker_worker(commands: queue.Queue, post: Callable[[str, dict | None], None]) -> None:
+    """Execute queued speaker commands in order; runs on a background thread.
+
+    Predicted states of SpeakerCommands are sent as-is; other actions go
+    through execute_action and the result is passed to `post(ip, state)`. A
+    failed prediction posts the state read back from the speaker, or None if
+    that fails too. Consecutive queued volume steps for one speaker are sent
+    as one relative change, and the resulting volume is posted if it differs
+    from the prediction.
+    """
+    while True:
+        batch = [commands.get()]
+        with contextlib.suppress(queue.Empty):
+            while True:
+                batch.append(commands.get_nowait())
+
+        delta = 0
+        for command, next_command in zip(batch, [*batch[1:], None], strict=True):
+            if command.predicted is None:
+                post(
+                    command.ip,
+                    execute_action(command.speaker, command.action, command.volume_step),
+                )
+                continue
+            if _is_volume_step(command):
+                delta += _volume_delta(command.action, command.volume_step)
+                if _is_volume_step(next_command) and next_command.ip == command.ip:
+                    continue
+
+                # A relative change is safe even if the cached volume is stale
+                total, delta = delta, 0
+                try:
+                    volume = command.speaker.set_relative_volume(total)
+                except Exception as e:
+                    print(f"Error executing action: {e}", file=sys.stderr)
+                    post(command.ip, read_state(command.speaker, command.action))
+                    continue
+                if volume != command.predicted["volume"]:
+                    post(command.ip, {**command.predicted, "volume": volume})
+                continue
+
+            try:
+                apply_state(command.speaker, command.predicted)
+            except Exception as e:
+                print(f"Error executing action: {e}", file=sys.stderr)
+                post(command.ip, read_state(command.speaker, command.action))
+
+
+def run_transport_listener(inbox: queue.Queue, post: Callable[[str, str | None], None]) -> None:
+    """Keep the transport state of speakers current; runs on a background thread.
+
+    `inbox` receives speakers to subscribe to and also serves as the event
+    queue of their AVTransport subscriptions, so play/pause can be predicted
+    without a GetTransportInfo call. State changes are passed to
+    `post(ip, transport_state)`. When a subscription fails to renew, None is
+    posted so play/pause reads the state from the speaker again, and the
+    speaker is queued to be subscribed anew.
+    """
+    while True:
+        item = inbox.get()
+        if isinstance(item, soco.SoCo):
+            try:
+                subscription = item.avTransport.subscribe(auto_renew=True, event_queue=inbox)
+            except Exception as e:
+                print(f"Error subscribing to speaker events: {e}", file=sys.stderr)
+                continue
+
+            def on_renew_fail(error: Exception, speaker: soco.SoCo = item) -> None:
+                print(f"Error renewing speaker events: {error}", file=sys.stderr)
+                post(speaker.ip_address, None)
+                inbox.put(speaker)
+
+            subscription.auto_renew_fail = on_renew_fail
+            continue
+
+        transport_state = item.variables.get("transport_state")
+        if transport_state:
+            post(item.service.soco.ip_address, transport_state)
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pytest
+
+from sonos_overlay import config
+
+
+@pytest.fixture
+def config_paths(tmp_path, monkeypatch):
+    """Point the config and cache paths at a temporary directory."""
+    config_path = tmp_path / ".sonos-ctl-overlay.yml"
+    cache_path = tmp_path / "cache" / "sonos-ctl-overlay.json"
+    monkeypatch.setattr(config, "CONFIG_PATH", config_path)
+    monkeypatch.setattr(config, "CACHE_PATH", cache_path)
+    config.load_config.cache_clear()
+    yield config_path, cache_path
+    config.load_config.cache_clear()
+
+
+def test_hex_to_rgb():
+    assert config.hex_to_rgb("#FF0000") == (1.0, 0.0, 0.0)
+    assert config.hex_to_rgb("#fff") == (1.0, 1.0, 1.0)
+
+
+@pytest.mark.parametrize("color", ["#ff", "#zzzzzz", "#-fffff", ""])
+def test_hex_to_rgb_rejects_invalid(color):
+    with pytest.raises(ValueError):
+        config.hex_to_rgb(color)
+
+
+def test_load_config_defaults_without_file(config_paths):
+    assert config.load_config() == config.Config()
+
+
+def test_invalid_color_falls_back_to_default(config_paths):
+    config_path, _ = config_paths
+    config_path.write_text('style:\n  font_color: "#zz"\n  background_color: "#abc"\n')
+
+    style = config.load_config().style
+    assert style.font_color == config.OverlayStyle().font_color
+    assert style.background_color == "#abc"
+
+
+def test_cache_is_written_and_reused(config_paths):
+    config_path, cache_path = config_paths
+    config_path.write_text('speaker_ip: "192.168.1.100"\nvolume_step: 4\n')
+
+    assert config.load_config().volume_step == 4
+    cache = json.loads(cache_path.read_text())
+    assert cache["data"] == {"speaker_ip": "192.168.1.100", "volume_step": 4}
+    assert os.listdir(cache_path.parent) == [cache_path.name]
+
+    # A cache hit must not need the YAML contents
+    data = dict(cache["data"], volume_step=6)
+    cache_path.write_text(json.dumps(dict(cache, data=data)))
+    config.load_config.cache_clear()
+    assert config.load_config().volume_step == 6
+
+
+def test_cache_is_ignored_when_yaml_changes(config_paths):
+    config_path, _ = config_paths
+    config_path.write_text("volume_step: 4\n")
+    assert config.load_config().volume_step == 4
+
+    config_path.write_text("volume_step: 10\n")
+    assert config.reload_config().volume_step == 10
+
+
+@pytest.mark.parametrize("content", ["[]", "null", '"text"', "not json"])
+def test_malformed_cache_is_a_miss(config_paths, content):
+    config_path, cache_path = config_paths
+    config_path.write_text('speaker_ip: "10.0.0.5"\n')
+    cache_path.parent.mkdir()
+    cache_path.write_text(content)
+
+    assert config.load_config().speaker_ip == "10.0.0.5"
+
+
+def test_cache_with_non_object_data_is_a_miss(config_paths):
+    config_path, cache_path = config_paths
+    config_path.write_text('speaker_ip: "10.0.0.5"\n')
+    src_stat = os.stat(config_path)
+    cache_path.parent.mkdir()
+    cache_path.write_text(
+        json.dumps({"_src_mtime": src_stat.st_mtime_ns, "_src_size": src_stat.st_size, "data": []})
+    )
+
+    assert config.load_config().speaker_ip == "10.0.0.5"
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from sonos_overlay.main import (
+    ACTIONS,
+    REQUEST_FRAME,
+    decode_request,
+    encode_request,
+    get_pid_path,
+    server_is_dead,
+)
+
+
+@pytest.mark.parametrize("action", ACTIONS)
+def test_request_round_trip(action):
+    request = {"action": action, "speaker_ip": "192.168.1.100"}
+    data = encode_request(request)
+
+    assert len(data) == REQUEST_FRAME.size == 64
+    assert decode_request(data) == request
+
+
+def test_get_pid_path():
+    assert get_pid_path("/tmp/sonos-ctl-overlay-501.sock") == "/tmp/sonos-ctl-overlay-501.pid"
+    assert get_pid_path("\0sonos-ctl-overlay-1000") == "/tmp/sonos-ctl-overlay-1000.pid"
+
+
+def test_server_is_dead_without_pid_file(tmp_path):
+    assert not server_is_dead(str(tmp_path / "missing.pid"))
+
+
+def test_server_is_dead_for_live_process(tmp_path):
+    pid_path = tmp_path / "server.pid"
+    pid_path.write_text(str(os.getpid()))
+    assert not server_is_dead(str(pid_path))
+
+
+def test_server_is_dead_for_exited_process(tmp_path):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    pid_path = tmp_path / "server.pid"
+    pid_path.write_text(str(process.pid))
+    assert server_is_dead(str(pid_path))
+
+
+def test_server_is_dead_ignores_symlinks(tmp_path):
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    target = tmp_path / "target"
+    target.write_text(str(process.pid))
+    pid_path = tmp_path / "server.pid"
+    pid_path.symlink_to(target)
+    assert not server_is_dead(str(pid_path))
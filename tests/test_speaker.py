@@ -0,0 +1,185 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from sonos_overlay.speaker import (
+    SPEAKER_STATE_TTL,
+    SpeakerCommand,
+    predict_state,
+    run_speaker_worker,
+)
+
+
+class FakeSpeaker:
+    """Records calls made by the speaker worker."""
+
+    def __init__(self, volume=20, muted=False, transport_state="PLAYING", fail=()):
+        self.calls = []
+        self._volume = volume
+        self._muted = muted
+        self._transport_state = transport_state
+        self._fail = fail
+
+    def _call(self, name, *args):
+        self.calls.append((name, *args))
+        if name in self._fail:
+            raise OSError(f"{name} failed")
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @property
+    def mute(self):
+        return self._muted
+
+    @mute.setter
+    def mute(self, value):
+        self._call("mute", value)
+        self._muted = value
+
+    def set_relative_volume(self, delta):
+        self._call("set_relative_volume", delta)
+        self._volume = min(100, max(0, self._volume + delta))
+        return self._volume
+
+    def get_current_transport_info(self):
+        return {"current_transport_state": self._transport_state}
+
+    def play(self):
+        self._call("play")
+
+    def pause(self):
+        self._call("pause")
+
+    def next(self):
+        self._call("next")
+
+    def previous(self):
+        self._call("previous")
+
+
+def fresh_cache(**state):
+    return {"volume": 50, "muted": False, "ts": time.monotonic(), "transport_state": None, **state}
+
+
+def run_worker(commands):
+    """Run the worker over `commands` and return everything it posted.
+
+    A final unpredicted next command marks the end of the batch.
+    """
+    posted = queue.Queue()
+    command_queue = queue.Queue()
+    for command in commands:
+        command_queue.put(command)
+    command_queue.put(SpeakerCommand("end", FakeSpeaker(), "next", 2, None))
+
+    threading.Thread(
+        target=run_speaker_worker,
+        args=(command_queue, lambda ip, state: posted.put((ip, state))),
+        daemon=True,
+    ).start()
+
+    results = []
+    while True:
+        ip, state = posted.get(timeout=5)
+        if ip == "end":
+            return results
+        results.append((ip, state))
+
+
+def volume_command(speaker, action, predicted_volume, ip="ip"):
+    predicted = {"action": action, "volume": predicted_volume, "muted": False}
+    return SpeakerCommand(ip, speaker, action, 2, predicted)
+
+
+def test_predict_volume_steps_clamp():
+    cache = fresh_cache(volume=99)
+    assert predict_state("volume_up", 2, cache)["volume"] == 100
+    assert predict_state("volume_down", 5, cache)["volume"] == 95
+
+
+def test_predict_mute_toggles():
+    cache = fresh_cache()
+    assert predict_state("mute", 2, cache)["muted"] is True
+    assert predict_state("mute", 2, cache)["muted"] is False
+
+
+@pytest.mark.parametrize("action", ["volume_up", "volume_down", "mute"])
+def test_predict_stale_cache(action):
+    cache = fresh_cache(ts=time.monotonic() - SPEAKER_STATE_TTL)
+    assert predict_state(action, 2, cache) is None
+
+
+def test_predict_playpause_needs_transport_state():
+    assert predict_state("playpause", 2, fresh_cache()) is None
+
+    cache = fresh_cache(transport_state="PLAYING")
+    assert predict_state("playpause", 2, cache)["state"] == "PAUSED_PLAYBACK"
+    assert predict_state("playpause", 2, cache)["state"] == "PLAYING"
+
+
+@pytest.mark.parametrize("action", ["next", "prev"])
+def test_predict_track_changes(action):
+    stale = fresh_cache(ts=-SPEAKER_STATE_TTL)
+    assert predict_state(action, 2, stale) == {"action": action, "state": "PLAYING"}
+
+
+def test_worker_sums_consecutive_volume_steps():
+    speaker = FakeSpeaker(volume=20)
+    commands = [
+        volume_command(speaker, "volume_up", 22),
+        volume_command(speaker, "volume_up", 24),
+        volume_command(speaker, "volume_down", 22),
+    ]
+
+    assert run_worker(commands) == []
+    assert speaker.calls == [("set_relative_volume", 2)]
+
+
+def test_worker_corrects_stale_volume_prediction():
+    # The cache predicted 62 but the volume was changed to 20 elsewhere
+    speaker = FakeSpeaker(volume=20)
+    posted = run_worker([volume_command(speaker, "volume_up", 62)])
+
+    assert speaker.calls == [("set_relative_volume", 2)]
+    assert posted == [("ip", {"action": "volume_up", "volume": 22, "muted": False})]
+
+
+def test_worker_keeps_volume_steps_of_other_speakers_apart():
+    first, second = FakeSpeaker(volume=10), FakeSpeaker(volume=30)
+    commands = [
+        volume_command(first, "volume_up", 12, ip="a"),
+        volume_command(second, "volume_up", 32, ip="b"),
+        volume_command(first, "volume_up", 14, ip="a"),
+    ]
+
+    assert run_worker(commands) == []
+    assert first.calls == [("set_relative_volume", 2), ("set_relative_volume", 2)]
+    assert second.calls == [("set_relative_volume", 2)]
+
+
+def test_worker_applies_predicted_playback_state():
+    speaker = FakeSpeaker()
+    predicted = {"action": "playpause", "state": "PAUSED_PLAYBACK"}
+
+    assert run_worker([SpeakerCommand("ip", speaker, "playpause", 2, predicted)]) == []
+    assert speaker.calls == [("pause",)]
+
+
+def test_worker_corrects_failed_playpause_prediction():
+    speaker = FakeSpeaker(transport_state="STOPPED", fail=("play",))
+    predicted = {"action": "playpause", "state": "PLAYING"}
+
+    posted = run_worker([SpeakerCommand("ip", speaker, "playpause", 2, predicted)])
+    assert posted == [("ip", {"action": "playpause", "state": "STOPPED"})]
+
+
+def test_worker_executes_unpredicted_actions():
+    speaker = FakeSpeaker(muted=False)
+    posted = run_worker([SpeakerCommand("ip", speaker, "mute", 2, None)])
+
+    assert speaker.calls == [("mute", True)]
+    assert posted == [("ip", {"action": "mute", "volume": 20, "muted": True})]